@@ -0,0 +1,27 @@
+﻿"""partial index for active sessions
+
+Revision ID: 20261015_0002
+Revises: 20260128_0001
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+
+
+revision = "20261015_0002"
+down_revision = "20260128_0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sessions_active_by_user "
+            "ON sessions (user_id) WHERE revoked_at IS NULL"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_sessions_active_by_user")
@@ -0,0 +1,32 @@
+﻿"""brin index on audit_logs.created_at
+
+Revision ID: 20261015_0003
+Revises: 20261015_0002
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+
+
+revision = "20261015_0003"
+down_revision = "20261015_0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_audit_logs_created_at_brin "
+            "ON audit_logs USING BRIN (created_at) WITH (pages_per_range = 128)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_audit_logs_created_at")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_audit_logs_created_at "
+            "ON audit_logs (created_at)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_audit_logs_created_at_brin")
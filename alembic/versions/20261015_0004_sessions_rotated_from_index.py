@@ -0,0 +1,27 @@
+﻿"""partial index on sessions.rotated_from_session_id
+
+Revision ID: 20261015_0004
+Revises: 20261015_0003
+Create Date: 2026-10-15
+"""
+
+from alembic import op
+
+
+revision = "20261015_0004"
+down_revision = "20261015_0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sessions_rotated_from_session_id "
+            "ON sessions (rotated_from_session_id) WHERE rotated_from_session_id IS NOT NULL"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_sessions_rotated_from_session_id")
@@ -1,28 +1,91 @@
-﻿import logging
+﻿import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
 
 import jwt
+from cachetools import TTLCache
 from fastapi import Request
 
 from app.core.config import get_settings
+from app.core.security import HS256_FAST_PATH, JWT_HS256_HEADER_B64, JWT_VERIFY_KEY, hs256_signature
 
 
 logger = logging.getLogger("app.auth")
 settings = get_settings()
 
+_TOKEN_CACHE: TTLCache = TTLCache(
+    maxsize=settings.access_token_cache_size,
+    ttl=settings.access_token_cache_ttl_seconds,
+)
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+_JWT = jwt.PyJWT()
+_KEY = JWT_VERIFY_KEY
+_ALGS = [settings.jwt_algorithm]
+_OPTIONS = {"require": ["exp", "sub"], "verify_signature": True}
+
+
+def _decode_hs256(token: str) -> dict:
+    signing_input, _, signature = token.encode("ascii").rpartition(b".")
+    header, _, body = signing_input.partition(b".")
+    # Anything that is not exactly our own header goes through PyJWT's full checks
+    if header != JWT_HS256_HEADER_B64:
+        return _JWT.decode(token, _KEY, algorithms=_ALGS, options=_OPTIONS)
+    if not hmac.compare_digest(hs256_signature(signing_input), signature):
+        raise jwt.InvalidSignatureError("Signature verification failed")
+
+    payload = json.loads(base64.urlsafe_b64decode(body + b"=" * (-len(body) % 4)))
+    if not isinstance(payload, dict):
+        raise jwt.DecodeError("Invalid payload")
+    if not isinstance(payload.get("sub"), str) or not isinstance(payload.get("exp"), int):
+        raise jwt.MissingRequiredClaimError("sub")
+    if payload["exp"] <= time.time():
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    return payload
+
 
 def decode_access_token(token: str) -> str | None:
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    with _TOKEN_CACHE_LOCK:
+        cached = _TOKEN_CACHE.get(key)
+        if cached is not None:
+            user_id, exp = cached
+            if time.time() < exp:
+                return user_id
+            del _TOKEN_CACHE[key]
+
     try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        return payload.get("sub")
-    except jwt.PyJWTError:
+        if HS256_FAST_PATH:
+            payload = _decode_hs256(token)
+        else:
+            payload = _JWT.decode(token, _KEY, algorithms=_ALGS, options=_OPTIONS)
+    except (jwt.PyJWTError, ValueError):
         return None
 
+    user_id = payload["sub"]
+    exp = payload["exp"]
+    # Only successful decodes are cached, and never past the token's own expiry
+    if user_id:
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE[key] = (user_id, exp)
+    return user_id
+
 
 def get_token_from_cookie(request: Request) -> str | None:
     return request.cookies.get("access_token")
 
 
 async def jwt_auth_middleware(request: Request, call_next):
+    # Skip cookie parsing entirely when no access token can be present
+    raw_cookie = request.headers.get("cookie")
+    if raw_cookie is None or "access_token=" not in raw_cookie or request.scope["path"] == "/health":
+        request.state.user_id = None
+        return await call_next(request)
+
     token = get_token_from_cookie(request)
     if token:
         user_id = decode_access_token(token)
@@ -15,6 +15,14 @@ class Settings(BaseSettings):
     postgres_db: str = "keyra"
     postgres_user: str = "keyra"
     postgres_password: str = "keyra"
+    # Per-worker Postgres connections: db_pool_size + db_max_overflow + pg_pool_max_size
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_recycle_seconds: int = 1800
+    db_statement_cache_size: int = 1024
+    db_prepared_statement_cache_size: int = 512
+    pg_pool_min_size: int = 2
+    pg_pool_max_size: int = 10
 
     # Redis
     redis_url: str = "redis://localhost:6379/0"
@@ -22,11 +30,15 @@ class Settings(BaseSettings):
     # Tokens / Cookies
     jwt_secret: str = "change-me"
     jwt_algorithm: str = "HS256"
+    jwt_private_key_path: str | None = None
+    jwt_public_key_path: str | None = None
     access_token_ttl_minutes: int = 15
     refresh_token_ttl_days: int = 30
     cookie_secure: bool = False
     cookie_samesite: str = "lax"
     cookie_domain: str | None = None
+    access_token_cache_size: int = 10_000
+    access_token_cache_ttl_seconds: int = 5
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,50 @@
+﻿import base64
+import hashlib
+import hmac
+from pathlib import Path
+
+from jwt.algorithms import get_default_algorithms
+
+from app.core.config import get_settings
+
+
+settings = get_settings()
+
+
+def _read_key(path: str | None) -> bytes | None:
+    if not path:
+        return None
+    return Path(path).read_bytes()
+
+
+def _load_jwt_keys():
+    # Keys are parsed once here so PyJWT gets ready key objects on every call
+    if settings.jwt_algorithm not in ("HS256", "EdDSA"):
+        raise RuntimeError(f"Unsupported JWT_ALGORITHM: {settings.jwt_algorithm} (expected HS256 or EdDSA)")
+    algorithm = get_default_algorithms()[settings.jwt_algorithm]
+    if settings.jwt_algorithm == "EdDSA":
+        # This service mints tokens too, so a signing key is always required
+        private_pem = _read_key(settings.jwt_private_key_path)
+        if not private_pem:
+            raise RuntimeError("EdDSA requires JWT_PRIVATE_KEY_PATH")
+        private_key = algorithm.prepare_key(private_pem)
+        public_pem = _read_key(settings.jwt_public_key_path)
+        public_key = algorithm.prepare_key(public_pem) if public_pem else private_key.public_key()
+        return private_key, public_key
+
+    key = algorithm.prepare_key(settings.jwt_secret)
+    return key, key
+
+
+JWT_SIGNING_KEY, JWT_VERIFY_KEY = _load_jwt_keys()
+
+# HS256 tokens are minted and verified by hand: static header, pre-keyed HMAC copied per call
+HS256_FAST_PATH = settings.jwt_algorithm == "HS256"
+JWT_HS256_HEADER_B64 = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+_HMAC_TEMPLATE = hmac.new(settings.jwt_secret.encode("utf-8"), None, hashlib.sha256)
+
+
+def hs256_signature(signing_input: bytes) -> bytes:
+    mac = _HMAC_TEMPLATE.copy()
+    mac.update(signing_input)
+    return base64.urlsafe_b64encode(mac.digest()).rstrip(b"=")
@@ -73,8 +73,20 @@ class AuditLog(Base):
     ip: Mapped[str | None] = mapped_column(String(45), nullable=True, index=True)
     user_agent: Mapped[str | None] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now(), nullable=False, index=True
+        DateTime(timezone=True), server_default=func.now(), nullable=False
     )
 
 
 Index("ix_sessions_user_id_created_at", Session.user_id, Session.created_at)
+Index("ix_sessions_active_by_user", Session.user_id, postgresql_where=Session.revoked_at.is_(None))
+Index(
+    "ix_sessions_rotated_from_session_id",
+    Session.rotated_from_session_id,
+    postgresql_where=Session.rotated_from_session_id.is_not(None),
+)
+Index(
+    "ix_audit_logs_created_at_brin",
+    AuditLog.created_at,
+    postgresql_using="brin",
+    postgresql_with={"pages_per_range": 128},
+)
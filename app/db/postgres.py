@@ -1,4 +1,5 @@
-﻿from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+﻿import asyncpg
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 
 from app.core.config import get_settings
 
@@ -8,13 +9,47 @@ settings = get_settings()
 engine: AsyncEngine = create_async_engine(
     settings.database_url,
     echo=settings.debug,
-    pool_pre_ping=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_recycle=settings.db_pool_recycle_seconds,
+    pool_pre_ping=False,
+    connect_args={
+        "statement_cache_size": settings.db_statement_cache_size,
+        "prepared_statement_cache_size": settings.db_prepared_statement_cache_size,
+    },
     future=True,
 )
 
 SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 
+# Raw asyncpg pool for hot single-row auth queries that skip the ORM
+pg_pool: asyncpg.Pool | None = None
+
+
+async def init_pg_pool() -> asyncpg.Pool:
+    global pg_pool
+    pg_pool = await asyncpg.create_pool(
+        settings.database_url_sync,
+        min_size=settings.pg_pool_min_size,
+        max_size=settings.pg_pool_max_size,
+        statement_cache_size=settings.db_statement_cache_size,
+    )
+    return pg_pool
+
+
+async def close_pg_pool():
+    global pg_pool
+    if pg_pool is not None:
+        await pg_pool.close()
+        pg_pool = None
+
 
 async def get_db_session():
     async with SessionLocal() as session:
         yield session
+
+
+async def get_pg_pool() -> asyncpg.Pool:
+    if pg_pool is None:
+        raise RuntimeError("asyncpg pool is not initialized")
+    return pg_pool
@@ -7,7 +7,9 @@ settings = get_settings()
 
 redis_client = Redis.from_url(
     settings.redis_url,
-    decode_responses=True,
+    decode_responses=False,
+    health_check_interval=30,
+    socket_keepalive=True,
 )
 
 
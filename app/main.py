@@ -1,13 +1,20 @@
-﻿from contextlib import asynccontextmanager
+﻿import asyncio
+import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from sqlalchemy import text
 
 from app.core.auth_middleware import jwt_auth_middleware
 from app.core.config import get_settings
-from app.db.postgres import engine
+from app.db.postgres import close_pg_pool, engine, init_pg_pool
 from app.db.redis import close_redis, redis_client
+from app.modules.audit.service import run_audit_flusher
 from app.modules.auth.router import router as auth_router
+from app.modules.auth.service import load_rate_limit_script
+
+
+logger = logging.getLogger("app")
 
 
 @asynccontextmanager
@@ -16,9 +23,20 @@ async def lifespan(app: FastAPI):
     async with engine.connect() as conn:
         await conn.execute(text("SELECT 1"))
     await redis_client.ping()
+    await load_rate_limit_script(redis_client)
+    pg_pool = await init_pg_pool()
+    audit_flusher = asyncio.create_task(run_audit_flusher(redis_client, pg_pool))
 
     yield
 
+    audit_flusher.cancel()
+    try:
+        await audit_flusher
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception("Audit flusher stopped with an error")
+    await close_pg_pool()
     await close_redis()
     await engine.dispose()
 
@@ -0,0 +1,189 @@
+﻿import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timezone
+
+import asyncpg
+from redis.exceptions import ResponseError
+
+
+logger = logging.getLogger("app.audit")
+
+AUDIT_STREAM = "audit"
+AUDIT_DEAD_LETTER_STREAM = "audit:dead"
+AUDIT_GROUP = "audit-flusher"
+AUDIT_STREAM_MAXLEN = 100_000
+AUDIT_BATCH_SIZE = 1000
+AUDIT_BLOCK_MS = 500
+AUDIT_RETRY_SECONDS = 1
+AUDIT_CLAIM_MIN_IDLE_MS = 60_000
+AUDIT_CLAIM_INTERVAL_SECONDS = 30
+
+# Rejected by Postgres for the row itself (bad value, FK gone), not a transient outage
+_BAD_ROW_ERRORS = (
+    asyncpg.exceptions.DataError,
+    asyncpg.exceptions.IntegrityConstraintViolationError,
+    ValueError,
+)
+
+_AUDIT_COLUMNS = ["id", "user_id", "event", "ip", "user_agent", "created_at"]
+_AUDIT_COLUMNS_SQL = ", ".join(_AUDIT_COLUMNS)
+# Row ids derive from the stream entry id, so a redelivered entry maps to the same row
+_AUDIT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "keyra:audit")
+
+
+async def record_audit_event(
+    redis_client,
+    event: str,
+    user_id: str | None = None,
+    ip: str | None = None,
+    user_agent: str | None = None,
+) -> None:
+    fields = {"event": event, "created_at": datetime.now(timezone.utc).isoformat()}
+    if user_id:
+        fields["user_id"] = str(user_id)
+    if ip:
+        fields["ip"] = ip
+    if user_agent:
+        fields["user_agent"] = user_agent
+
+    # Audit must never fail the request it describes
+    try:
+        await redis_client.xadd(AUDIT_STREAM, fields, maxlen=AUDIT_STREAM_MAXLEN, approximate=True)
+    except Exception:
+        logger.warning("Failed to enqueue audit event=%s", event, exc_info=True)
+
+
+def _decode(value: bytes | None) -> str | None:
+    return value.decode("utf-8") if value is not None else None
+
+
+def _to_record(message_id: bytes, fields: dict) -> tuple:
+    user_id = fields.get(b"user_id")
+    return (
+        uuid.uuid5(_AUDIT_ID_NAMESPACE, message_id.decode("ascii")),
+        uuid.UUID(user_id.decode("ascii")) if user_id else None,
+        fields[b"event"].decode("utf-8"),
+        _decode(fields.get(b"ip")),
+        _decode(fields.get(b"user_agent")),
+        datetime.fromisoformat(fields[b"created_at"].decode("ascii")),
+    )
+
+
+async def _ensure_audit_group(redis_client) -> None:
+    try:
+        await redis_client.xgroup_create(AUDIT_STREAM, AUDIT_GROUP, id="0", mkstream=True)
+    except ResponseError as exc:
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+async def _dead_letter(redis_client, message_id, fields: dict, error: str) -> None:
+    logger.error("Dropping audit entry %s to %s: %s", message_id, AUDIT_DEAD_LETTER_STREAM, error)
+    await redis_client.xadd(
+        AUDIT_DEAD_LETTER_STREAM,
+        {**fields, b"source_id": message_id, b"error": error},
+        maxlen=AUDIT_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+async def _copy_entries(conn, redis_client, entries: list) -> None:
+    if not entries:
+        return
+    try:
+        # COPY into a staging table so rows already written by an earlier attempt are skipped
+        async with conn.transaction():
+            await conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS audit_logs_stage "
+                "(LIKE audit_logs INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+            await conn.copy_records_to_table(
+                "audit_logs_stage",
+                records=[record for _, _, record in entries],
+                columns=_AUDIT_COLUMNS,
+            )
+            await conn.execute(
+                f"INSERT INTO audit_logs ({_AUDIT_COLUMNS_SQL}) "
+                f"SELECT {_AUDIT_COLUMNS_SQL} FROM audit_logs_stage ON CONFLICT (id) DO NOTHING"
+            )
+    except _BAD_ROW_ERRORS as exc:
+        # Each attempt is all-or-nothing, so bisect until the offending rows are isolated
+        if len(entries) == 1:
+            message_id, fields, _ = entries[0]
+            await _dead_letter(redis_client, message_id, fields, repr(exc))
+            return
+        mid = len(entries) // 2
+        await _copy_entries(conn, redis_client, entries[:mid])
+        await _copy_entries(conn, redis_client, entries[mid:])
+
+
+async def _flush(redis_client, pool: asyncpg.Pool, messages: list) -> None:
+    ack_ids = []
+    entries = []
+    for message_id, fields in messages:
+        if message_id is None:
+            continue
+        ack_ids.append(message_id)
+        # Entries trimmed by MAXLEN while pending come back without fields
+        if not fields:
+            continue
+        try:
+            entries.append((message_id, fields, _to_record(message_id, fields)))
+        except (KeyError, ValueError) as exc:
+            await _dead_letter(redis_client, message_id, fields, repr(exc))
+
+    if entries:
+        async with pool.acquire() as conn:
+            await _copy_entries(conn, redis_client, entries)
+    if ack_ids:
+        await redis_client.xack(AUDIT_STREAM, AUDIT_GROUP, *ack_ids)
+
+
+async def run_audit_flusher(redis_client, pool: asyncpg.Pool) -> None:
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    loop = asyncio.get_running_loop()
+    group_ready = False
+    claim_cursor = "0-0"
+    next_claim_at = 0.0
+
+    while True:
+        try:
+            if not group_ready:
+                await _ensure_audit_group(redis_client)
+                group_ready = True
+
+            if loop.time() >= next_claim_at:
+                # Take over entries left un-acked by crashed or restarted consumers
+                response = await redis_client.xautoclaim(
+                    AUDIT_STREAM,
+                    AUDIT_GROUP,
+                    consumer,
+                    AUDIT_CLAIM_MIN_IDLE_MS,
+                    start_id=claim_cursor,
+                    count=AUDIT_BATCH_SIZE,
+                )
+                claim_cursor, messages = response[0], response[1]
+                if claim_cursor in ("0-0", b"0-0"):
+                    next_claim_at = loop.time() + AUDIT_CLAIM_INTERVAL_SECONDS
+            else:
+                response = await redis_client.xreadgroup(
+                    AUDIT_GROUP,
+                    consumer,
+                    {AUDIT_STREAM: ">"},
+                    count=AUDIT_BATCH_SIZE,
+                    block=AUDIT_BLOCK_MS,
+                )
+                messages = response[0][1] if response else []
+
+            if messages:
+                await _flush(redis_client, pool, messages)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Un-acked entries are picked up again by the next XAUTOCLAIM pass
+            logger.exception("Audit flush failed, retrying")
+            group_ready = False
+            await asyncio.sleep(AUDIT_RETRY_SECONDS)
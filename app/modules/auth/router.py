@@ -1,11 +1,13 @@
 ﻿import logging
 
+import asyncpg
 from fastapi import APIRouter, Depends, Request, Response, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
-from app.db.postgres import get_db_session
+from app.db.postgres import get_db_session, get_pg_pool
 from app.db.redis import redis_client
+from app.modules.audit.service import record_audit_event
 from app.modules.auth.schemas import MagicLinkRequest, MagicLinkResponse, MagicLinkVerifyRequest, UserMeResponse
 from app.modules.auth.service import (
     check_rate_limit,
@@ -22,7 +24,15 @@ from app.modules.auth.service import (
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 logger = logging.getLogger("app.auth")
-settings = get_settings()
+
+# Cookie params are frozen at import so handlers only do local lookups
+_settings = get_settings()
+_COOKIE_SECURE = _settings.cookie_secure
+_COOKIE_SAMESITE = _settings.cookie_samesite
+_COOKIE_DOMAIN = _settings.cookie_domain
+_ACCESS_MAX_AGE = _settings.access_token_ttl_minutes * 60
+_REFRESH_MAX_AGE = _settings.refresh_token_ttl_days * 24 * 60 * 60
+del _settings
 
 
 def _get_user_id_from_request(request: Request) -> str:
@@ -72,35 +82,38 @@ async def verify_magic_link(
 
     try:
         async with session.begin():
-            access_token, refresh_token = await verify_magic_token_and_create_session(
+            access_token, refresh_token, user_id = await verify_magic_token_and_create_session(
                 session=session,
                 token=payload.token,
                 request_ip=client_ip,
                 request_user_agent=user_agent,
             )
     except ValueError:
+        await record_audit_event(redis_client, "magic_link_invalid", ip=client_ip, user_agent=user_agent)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="invalid_or_expired_token",
         )
 
+    await record_audit_event(redis_client, "login", user_id=user_id, ip=client_ip, user_agent=user_agent)
+
     response.set_cookie(
         "access_token",
         access_token,
         httponly=True,
-        secure=settings.cookie_secure,
-        samesite=settings.cookie_samesite,
-        domain=settings.cookie_domain,
-        max_age=settings.access_token_ttl_minutes * 60,
+        secure=_COOKIE_SECURE,
+        samesite=_COOKIE_SAMESITE,
+        domain=_COOKIE_DOMAIN,
+        max_age=_ACCESS_MAX_AGE,
     )
     response.set_cookie(
         "refresh_token",
         refresh_token,
         httponly=True,
-        secure=settings.cookie_secure,
-        samesite=settings.cookie_samesite,
-        domain=settings.cookie_domain,
-        max_age=settings.refresh_token_ttl_days * 24 * 60 * 60,
+        secure=_COOKIE_SECURE,
+        samesite=_COOKIE_SAMESITE,
+        domain=_COOKIE_DOMAIN,
+        max_age=_REFRESH_MAX_AGE,
     )
 
     return MagicLinkResponse()
@@ -119,36 +132,44 @@ async def refresh_session(
     client_ip = request.client.host if request.client else None
     user_agent = request.headers.get("user-agent")
 
-    try:
-        async with session.begin():
-            access_token, new_refresh_token = await rotate_refresh_token(
+    error = None
+    async with session.begin():
+        try:
+            access_token, new_refresh_token, user_id = await rotate_refresh_token(
                 session=session,
                 refresh_token=refresh_token,
                 request_ip=client_ip,
                 request_user_agent=user_agent,
             )
-    except ValueError as exc:
-        if str(exc) in {"refresh_token_reuse", "session_hijacking", "refresh_token_expired"}:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc))
+        except ValueError as exc:
+            # Caught inside the transaction so a chain revocation on reuse/expiry/hijack is committed
+            error = str(exc)
+
+    if error is not None:
+        await record_audit_event(redis_client, f"refresh_failed:{error}", ip=client_ip, user_agent=user_agent)
+        if error in {"refresh_token_reuse", "session_hijacking", "refresh_token_expired"}:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=error)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid_refresh_token")
 
+    await record_audit_event(redis_client, "refresh", user_id=user_id, ip=client_ip, user_agent=user_agent)
+
     response.set_cookie(
         "access_token",
         access_token,
         httponly=True,
-        secure=settings.cookie_secure,
-        samesite=settings.cookie_samesite,
-        domain=settings.cookie_domain,
-        max_age=settings.access_token_ttl_minutes * 60,
+        secure=_COOKIE_SECURE,
+        samesite=_COOKIE_SAMESITE,
+        domain=_COOKIE_DOMAIN,
+        max_age=_ACCESS_MAX_AGE,
     )
     response.set_cookie(
         "refresh_token",
         new_refresh_token,
         httponly=True,
-        secure=settings.cookie_secure,
-        samesite=settings.cookie_samesite,
-        domain=settings.cookie_domain,
-        max_age=settings.refresh_token_ttl_days * 24 * 60 * 60,
+        secure=_COOKIE_SECURE,
+        samesite=_COOKIE_SAMESITE,
+        domain=_COOKIE_DOMAIN,
+        max_age=_REFRESH_MAX_AGE,
     )
 
     return MagicLinkResponse()
@@ -169,8 +190,16 @@ async def logout(
         if not ok:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid_refresh_token")
 
-    response.delete_cookie("access_token", domain=settings.cookie_domain)
-    response.delete_cookie("refresh_token", domain=settings.cookie_domain)
+    await record_audit_event(
+        redis_client,
+        "logout",
+        user_id=getattr(request.state, "user_id", None),
+        ip=request.client.host if request.client else None,
+        user_agent=request.headers.get("user-agent"),
+    )
+
+    response.delete_cookie("access_token", domain=_COOKIE_DOMAIN)
+    response.delete_cookie("refresh_token", domain=_COOKIE_DOMAIN)
     return MagicLinkResponse()
 
 
@@ -185,24 +214,32 @@ async def logout_all(
     async with session.begin():
         await revoke_all_sessions_for_user(session, user_id)
 
-    response.delete_cookie("access_token", domain=settings.cookie_domain)
-    response.delete_cookie("refresh_token", domain=settings.cookie_domain)
+    await record_audit_event(
+        redis_client,
+        "logout_all",
+        user_id=user_id,
+        ip=request.client.host if request.client else None,
+        user_agent=request.headers.get("user-agent"),
+    )
+
+    response.delete_cookie("access_token", domain=_COOKIE_DOMAIN)
+    response.delete_cookie("refresh_token", domain=_COOKIE_DOMAIN)
     return MagicLinkResponse()
 
 
 @router.get("/me", response_model=UserMeResponse)
 async def me(
     request: Request,
-    session: AsyncSession = Depends(get_db_session),
+    pool: asyncpg.Pool = Depends(get_pg_pool),
 ):
     user_id = _get_user_id_from_request(request)
-    user = await get_user_by_id(session, user_id)
+    user = await get_user_by_id(pool, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="unauthorized")
 
     return UserMeResponse(
-        id=str(user.id),
-        email=user.email,
-        email_verified_at=user.email_verified_at,
-        created_at=user.created_at,
+        id=str(user["id"]),
+        email=user["email"],
+        email_verified_at=user["email_verified_at"],
+        created_at=user["created_at"],
     )
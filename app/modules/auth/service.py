@@ -1,14 +1,22 @@
-﻿import logging
+﻿import base64
+import logging
 import hashlib
-import secrets
+import os
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
+import asyncpg
 import jwt
-from sqlalchemy import select, update
+from redis.exceptions import NoScriptError
+from sqlalchemy import bindparam, select, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
-from app.db.models import LoginChallenge, Session as UserSession, User
+from app.core.security import HS256_FAST_PATH, JWT_HS256_HEADER_B64, JWT_SIGNING_KEY, hs256_signature
+from app.db.models import LoginChallenge, Session as UserSession
 
 
 logger = logging.getLogger("app.auth")
@@ -18,32 +26,91 @@ RATE_LIMIT_WINDOW_SECONDS = 600
 RATE_LIMIT_MAX = 5
 
 settings = get_settings()
-
-
+_ACCESS_TTL_SECONDS = settings.access_token_ttl_minutes * 60
+_REFRESH_TTL = timedelta(days=settings.refresh_token_ttl_days)
+
+# Both counters are bumped atomically in one round trip; TTL is set on first hit
+_RATE_LIMIT_LUA = """
+local e = redis.call('INCR', KEYS[1])
+if e == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end
+local i = redis.call('INCR', KEYS[2])
+if i == 1 then redis.call('EXPIRE', KEYS[2], ARGV[1]) end
+return {e, i}
+"""
+_RATE_LIMIT_SHA = hashlib.sha1(_RATE_LIMIT_LUA.encode("utf-8")).hexdigest()
+
+# Hot statement is built once and executed with bound params per request
+_SEL_SESSION_BY_REFRESH = (
+    select(UserSession).where(UserSession.refresh_token_hash == bindparam("h")).with_for_update()
+)
+
+
+@lru_cache(maxsize=4096)
 def normalize_email(email: str) -> str:
     return email.strip().lower()
 
 
-def _hash_token(token: str) -> str:
-    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+def _hash_token(token: bytes) -> str:
+    return hashlib.sha256(token).hexdigest()
+
+
+_RNG_CHUNK_SIZE = 4096
+_RNG_LOCK = threading.Lock()
+_RNG_BUF = bytearray()
+_RNG_POS = 0
+
+
+def _reset_rng_buffer() -> None:
+    global _RNG_POS
+    _RNG_BUF.clear()
+    _RNG_POS = 0
+
+
+# A forked worker must never reuse random bytes buffered by its parent
+os.register_at_fork(after_in_child=_reset_rng_buffer)
+
+
+def _random_bytes(n: int) -> bytes:
+    global _RNG_POS
+    with _RNG_LOCK:
+        if len(_RNG_BUF) - _RNG_POS < n:
+            _RNG_BUF[:] = os.urandom(max(_RNG_CHUNK_SIZE, n))
+            _RNG_POS = 0
+        chunk = bytes(_RNG_BUF[_RNG_POS:_RNG_POS + n])
+        # Wipe handed-out bytes so issued tokens do not linger in the buffer
+        _RNG_BUF[_RNG_POS:_RNG_POS + n] = bytes(n)
+        _RNG_POS += n
+        return chunk
 
 
-def _generate_token() -> str:
-    return secrets.token_urlsafe(32)
+def _generate_token() -> bytes:
+    return base64.urlsafe_b64encode(_random_bytes(32)).rstrip(b"=")
 
 
-def _generate_refresh_token() -> str:
-    return secrets.token_urlsafe(48)
+def _generate_refresh_token() -> bytes:
+    return base64.urlsafe_b64encode(_random_bytes(48)).rstrip(b"=")
 
 
 def create_access_token(user_id: str) -> str:
-    now = datetime.now(timezone.utc)
+    now_ts = int(time.time())
+    exp_ts = now_ts + _ACCESS_TTL_SECONDS
+    if HS256_FAST_PATH:
+        # Round-tripping through UUID guarantees the subject is safe to inline as JSON
+        sub = str(uuid.UUID(user_id))
+        body = f'{{"sub":"{sub}","iat":{now_ts},"exp":{exp_ts}}}'.encode("ascii")
+        signing_input = JWT_HS256_HEADER_B64 + b"." + base64.urlsafe_b64encode(body).rstrip(b"=")
+        return (signing_input + b"." + hs256_signature(signing_input)).decode("ascii")
+
     payload = {
         "sub": user_id,
-        "iat": int(now.timestamp()),
-        "exp": int((now + timedelta(minutes=settings.access_token_ttl_minutes)).timestamp()),
+        "iat": now_ts,
+        "exp": exp_ts,
     }
-    return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algorithm)
+    return jwt.encode(payload, JWT_SIGNING_KEY, algorithm=settings.jwt_algorithm)
+
+
+async def load_rate_limit_script(redis_client) -> None:
+    await redis_client.script_load(_RATE_LIMIT_LUA)
 
 
 async def check_rate_limit(redis_client, email: str, ip: str | None) -> bool:
@@ -53,15 +120,15 @@ async def check_rate_limit(redis_client, email: str, ip: str | None) -> bool:
     key_email = f"rl:magic:email:{email}"
     key_ip = f"rl:magic:ip:{ip}"
 
-    pipe = redis_client.pipeline()
-    pipe.incr(key_email)
-    pipe.expire(key_email, RATE_LIMIT_WINDOW_SECONDS)
-    pipe.incr(key_ip)
-    pipe.expire(key_ip, RATE_LIMIT_WINDOW_SECONDS)
-    results = await pipe.execute()
-
-    email_count = results[0]
-    ip_count = results[2]
+    try:
+        email_count, ip_count = await redis_client.evalsha(
+            _RATE_LIMIT_SHA, 2, key_email, key_ip, RATE_LIMIT_WINDOW_SECONDS
+        )
+    except NoScriptError:
+        await load_rate_limit_script(redis_client)
+        email_count, ip_count = await redis_client.evalsha(
+            _RATE_LIMIT_SHA, 2, key_email, key_ip, RATE_LIMIT_WINDOW_SECONDS
+        )
 
     if email_count > RATE_LIMIT_MAX or ip_count > RATE_LIMIT_MAX:
         return False
@@ -90,91 +157,91 @@ async def create_login_challenge(
     session.add(challenge)
     await session.commit()
 
-    return token
+    return token.decode("ascii")
 
 
 def log_magic_link(email: str, token: str) -> None:
     logger.info("Magic link generated for %s: token=%s", email, token)
 
 
+_VERIFY_MAGIC_TOKEN_SQL = text(
+    """
+    WITH c AS (
+        UPDATE login_challenges SET used_at = :now
+        WHERE token_hash = :h AND used_at IS NULL AND expires_at > :now
+        RETURNING email
+    ),
+    u AS (
+        INSERT INTO users (id, email)
+        SELECT gen_random_uuid(), email FROM c
+        ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
+        RETURNING id
+    ),
+    s AS (
+        INSERT INTO sessions (id, user_id, refresh_token_hash, refresh_expires_at, ip, user_agent, last_seen_at)
+        SELECT gen_random_uuid(), u.id, :rh, :rexp, :ip, :ua, :now FROM u
+        RETURNING user_id
+    )
+    SELECT user_id FROM s
+    """
+)
+
+
 async def verify_magic_token_and_create_session(
     session: AsyncSession,
     token: str,
     request_ip: str | None,
     request_user_agent: str | None,
-) -> tuple[str, str]:
-    token_hash = _hash_token(token)
+) -> tuple[str, str, str]:
+    token_hash = _hash_token(token.encode("utf-8"))
     now = datetime.now(timezone.utc)
 
-    stmt = (
-        select(LoginChallenge)
-        .where(
-            LoginChallenge.token_hash == token_hash,
-            LoginChallenge.used_at.is_(None),
-            LoginChallenge.expires_at > now,
-        )
-        .with_for_update()
+    refresh_token = _generate_refresh_token()
+    refresh_token_hash = _hash_token(refresh_token)
+    refresh_expires_at = now + _REFRESH_TTL
+
+    # Consume the challenge, upsert the user and open the session in one round trip
+    result = await session.execute(
+        _VERIFY_MAGIC_TOKEN_SQL,
+        {
+            "h": token_hash,
+            "now": now,
+            "rh": refresh_token_hash,
+            "rexp": refresh_expires_at,
+            "ip": request_ip,
+            "ua": request_user_agent,
+        },
     )
-    result = await session.execute(stmt)
-    challenge = result.scalar_one_or_none()
-    if not challenge:
+    user_id = result.scalar_one_or_none()
+    if not user_id:
         raise ValueError("invalid_or_expired_token")
 
-    challenge.used_at = now
+    access_token = create_access_token(str(user_id))
+    return access_token, refresh_token.decode("ascii"), str(user_id)
 
-    user_stmt = select(User).where(User.email == challenge.email)
-    user_result = await session.execute(user_stmt)
-    user = user_result.scalar_one_or_none()
-    if not user:
-        user = User(email=challenge.email)
-        session.add(user)
-        await session.flush()
 
-    refresh_token = _generate_refresh_token()
-    refresh_token_hash = _hash_token(refresh_token)
-    refresh_expires_at = now + timedelta(days=settings.refresh_token_ttl_days)
-
-    user_session = UserSession(
-        user_id=user.id,
-        refresh_token_hash=refresh_token_hash,
-        refresh_expires_at=refresh_expires_at,
-        ip=request_ip,
-        user_agent=request_user_agent,
-        last_seen_at=now,
+_REVOKE_SESSION_CHAIN_SQL = text(
+    """
+    WITH RECURSIVE chain(id) AS (
+        SELECT CAST(:root AS uuid)
+        UNION
+        SELECT s.id FROM sessions s JOIN chain c ON s.rotated_from_session_id = c.id
     )
-    session.add(user_session)
-    await session.flush()
-
-    access_token = create_access_token(str(user.id))
-    return access_token, refresh_token
+    UPDATE sessions SET revoked_at = :now
+    FROM chain
+    WHERE sessions.id = chain.id
+    """
+)
 
 
-async def _collect_session_chain_ids(
+async def revoke_session_chain(
     session: AsyncSession,
     root_session_id,
-) -> list:
-    ids = [root_session_id]
-    idx = 0
-    while idx < len(ids):
-        current_id = ids[idx]
-        stmt = select(UserSession.id).where(UserSession.rotated_from_session_id == current_id)
-        result = await session.execute(stmt)
-        child_ids = [row[0] for row in result.all()]
-        for child_id in child_ids:
-            if child_id not in ids:
-                ids.append(child_id)
-        idx += 1
-    return ids
-
-
-async def revoke_session_chain(session: AsyncSession, root_session_id) -> None:
-    now = datetime.now(timezone.utc)
-    ids = await _collect_session_chain_ids(session, root_session_id)
-    await session.execute(
-        update(UserSession)
-        .where(UserSession.id.in_(ids))
-        .values(revoked_at=now)
-    )
+    now: datetime | None = None,
+) -> None:
+    if now is None:
+        now = datetime.now(timezone.utc)
+    await session.execute(_REVOKE_SESSION_CHAIN_SQL, {"root": root_session_id, "now": now})
 
 
 async def rotate_refresh_token(
@@ -182,36 +249,35 @@ async def rotate_refresh_token(
     refresh_token: str,
     request_ip: str | None,
     request_user_agent: str | None,
-) -> tuple[str, str]:
+) -> tuple[str, str, str]:
     now = datetime.now(timezone.utc)
-    token_hash = _hash_token(refresh_token)
+    token_hash = _hash_token(refresh_token.encode("utf-8"))
 
-    stmt = select(UserSession).where(UserSession.refresh_token_hash == token_hash).with_for_update()
-    result = await session.execute(stmt)
+    result = await session.execute(_SEL_SESSION_BY_REFRESH, {"h": token_hash})
     current_session = result.scalar_one_or_none()
 
     if not current_session:
         raise ValueError("invalid_refresh_token")
 
     if current_session.revoked_at is not None:
-        await revoke_session_chain(session, current_session.id)
+        await revoke_session_chain(session, current_session.id, now)
         raise ValueError("refresh_token_reuse")
 
     if current_session.refresh_expires_at <= now:
-        await revoke_session_chain(session, current_session.id)
+        await revoke_session_chain(session, current_session.id, now)
         raise ValueError("refresh_token_expired")
 
     if current_session.ip and request_ip and current_session.ip != request_ip:
-        await revoke_session_chain(session, current_session.id)
+        await revoke_session_chain(session, current_session.id, now)
         raise ValueError("session_hijacking")
 
     if current_session.user_agent and request_user_agent and current_session.user_agent != request_user_agent:
-        await revoke_session_chain(session, current_session.id)
+        await revoke_session_chain(session, current_session.id, now)
         raise ValueError("session_hijacking")
 
     new_refresh_token = _generate_refresh_token()
     new_refresh_token_hash = _hash_token(new_refresh_token)
-    refresh_expires_at = now + timedelta(days=settings.refresh_token_ttl_days)
+    refresh_expires_at = now + _REFRESH_TTL
 
     new_session = UserSession(
         user_id=current_session.user_id,
@@ -227,14 +293,13 @@ async def rotate_refresh_token(
     current_session.revoked_at = now
 
     access_token = create_access_token(str(current_session.user_id))
-    return access_token, new_refresh_token
+    return access_token, new_refresh_token.decode("ascii"), str(current_session.user_id)
 
 
 async def revoke_session_by_refresh_token(session: AsyncSession, refresh_token: str) -> bool:
     now = datetime.now(timezone.utc)
-    token_hash = _hash_token(refresh_token)
-    stmt = select(UserSession).where(UserSession.refresh_token_hash == token_hash).with_for_update()
-    result = await session.execute(stmt)
+    token_hash = _hash_token(refresh_token.encode("utf-8"))
+    result = await session.execute(_SEL_SESSION_BY_REFRESH, {"h": token_hash})
     current_session = result.scalar_one_or_none()
     if not current_session:
         return False
@@ -246,12 +311,13 @@ async def revoke_all_sessions_for_user(session: AsyncSession, user_id: str) -> N
     now = datetime.now(timezone.utc)
     await session.execute(
         update(UserSession)
-        .where(UserSession.user_id == user_id)
+        .where(UserSession.user_id == user_id, UserSession.revoked_at.is_(None))
         .values(revoked_at=now)
     )
 
 
-async def get_user_by_id(session: AsyncSession, user_id: str):
-    stmt = select(User).where(User.id == user_id)
-    result = await session.execute(stmt)
-    return result.scalar_one_or_none()
+async def get_user_by_id(pool: asyncpg.Pool, user_id: str) -> asyncpg.Record | None:
+    return await pool.fetchrow(
+        "SELECT id, email, email_verified_at, created_at FROM users WHERE id = $1",
+        user_id,
+    )
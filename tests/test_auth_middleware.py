@@ -0,0 +1,81 @@
+import base64
+import json
+import time
+import uuid
+
+import jwt
+import pytest
+
+from app.core import auth_middleware
+from app.core.config import get_settings
+from app.core.security import JWT_HS256_HEADER_B64, hs256_signature
+from app.core.auth_middleware import decode_access_token
+
+
+settings = get_settings()
+
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    auth_middleware._TOKEN_CACHE.clear()
+    yield
+    auth_middleware._TOKEN_CACHE.clear()
+
+
+def _pyjwt_token(user_id: str, exp_delta: int = 60, headers: dict | None = None) -> str:
+    now = int(time.time())
+    payload = {"sub": user_id, "iat": now, "exp": now + exp_delta}
+    return jwt.encode(payload, settings.jwt_secret, algorithm="HS256", headers=headers)
+
+
+def _signed(body: bytes) -> str:
+    signing_input = JWT_HS256_HEADER_B64 + b"." + base64.urlsafe_b64encode(body).rstrip(b"=")
+    return (signing_input + b"." + hs256_signature(signing_input)).decode("ascii")
+
+
+def test_pyjwt_token_uses_fast_path_and_decodes():
+    user_id = str(uuid.uuid4())
+    token = _pyjwt_token(user_id)
+    assert token.split(".")[0].encode("ascii") == JWT_HS256_HEADER_B64
+    assert decode_access_token(token) == user_id
+
+
+def test_other_headers_fall_back_to_pyjwt():
+    user_id = str(uuid.uuid4())
+    token = _pyjwt_token(user_id, headers={"kid": "k1"})
+    assert decode_access_token(token) == user_id
+
+
+def test_tampered_signature_is_rejected():
+    token = _pyjwt_token(str(uuid.uuid4()))
+    head, body, sig = token.split(".")
+    tampered_sig = ("A" if sig[0] != "A" else "B") + sig[1:]
+    assert decode_access_token(f"{head}.{body}.{tampered_sig}") is None
+
+
+def test_tampered_payload_is_rejected():
+    token = _pyjwt_token(str(uuid.uuid4()))
+    head, _, sig = token.split(".")
+    forged = base64.urlsafe_b64encode(json.dumps({"sub": str(uuid.uuid4()), "exp": 2**31}).encode()).rstrip(b"=")
+    assert decode_access_token(f"{head}.{forged.decode()}.{sig}") is None
+
+
+def test_expired_token_is_rejected():
+    token = _pyjwt_token(str(uuid.uuid4()), exp_delta=-1)
+    assert decode_access_token(token) is None
+
+
+def test_wrong_secret_is_rejected():
+    now = int(time.time())
+    token = jwt.encode({"sub": str(uuid.uuid4()), "exp": now + 60}, settings.jwt_secret + "x", algorithm="HS256")
+    assert decode_access_token(token) is None
+
+
+@pytest.mark.parametrize("body", [b"[]", b'"sub"', b"{}", b'{"sub":"x"}', b'{"sub":1,"exp":9999999999}'])
+def test_malformed_signed_payload_is_rejected(body):
+    assert decode_access_token(_signed(body)) is None
+
+
+@pytest.mark.parametrize("token", ["", "garbage", "a.b.c", "é.x.y"])
+def test_garbage_is_rejected(token):
+    assert decode_access_token(token) is None